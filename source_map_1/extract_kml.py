@@ -6,73 +6,140 @@ Google Maps KML 下載工具
 """
 
 import requests
-import re
 import sys
 import os
-import xml.etree.ElementTree as ET
 import csv
 import html
+import io
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from contextlib import redirect_stdout
+from functools import partial
+from operator import itemgetter
 from typing import Optional, List, Dict, Any, Tuple
 from urllib.parse import urlparse, parse_qs
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+# 優先使用 lxml (libxml2 C 實作)，未安裝時退回標準函式庫
+try:
+    from lxml import etree as ET
+    HAS_LXML = True
+except ImportError:
+    import xml.etree.ElementTree as ET
+    HAS_LXML = False
+
+# 優先使用 regex 套件；標準函式庫 re 要到 Python 3.11 才支援 atomic group
+try:
+    import regex as _re
+except ImportError:
+    import re as _re
+
+# 預先組好 Clark notation ({namespace}tag) 的標籤，find 時不必再解析 'kml:' 前綴
+KML_NS = '{http://www.opengis.net/kml/2.2}'
+KML_FOLDER = KML_NS + 'Folder'
+KML_PLACEMARK = KML_NS + 'Placemark'
+KML_NAME = KML_NS + 'name'
+KML_DESCRIPTION = KML_NS + 'description'
+KML_STYLE_URL = KML_NS + 'styleUrl'
+KML_COORDINATES = './/' + KML_NS + 'coordinates'
+
+DOWNLOAD_CHUNK_SIZE = 64 * 1024
+DOWNLOAD_WORKERS = 4
+
+CSV_FIELDS = ['folder', 'name', 'description', 'style_url', 'latitude', 'longitude', 'source']
+
+# clean_html_tags 每個 Placemark 都會呼叫，正規表示式預先編譯
+# 標籤內容以 atomic group 比對，遇到未閉合的 '<' 時不會逐字回溯；
+# Python 3.11 以前且未安裝 regex 時不支援此語法，退回一般的比對方式
+_CDATA_RE = _re.compile(r'<!\[CDATA\[(.*?)\]\]>', _re.DOTALL)
+try:
+    _TAG_RE = _re.compile(r'<(?>[^>]+)>')
+except _re.error:
+    _TAG_RE = _re.compile(r'<[^>]+>')
+_WS_RE = _re.compile(r'\s+')
 
 
 class KMLParser:
     """KML 解析器 - 提取 Placemark 資料並清理 HTML 標籤"""
 
-    def __init__(self):
+    def __init__(self, verbose: bool = False):
         self.placemarks = []
-        self.ns = {'kml': 'http://www.opengis.net/kml/2.2'}
+        # verbose 為 False 時不逐筆輸出，只在結束時輸出摘要
+        self.verbose = verbose
+        self.invalid_coordinate_count = 0
 
     def clean_html_tags(self, text: str) -> str:
         """移除 HTML 標籤並解碼實體"""
         if not text:
             return ""
-        text = re.sub(r'<!\[CDATA\[(.*?)\]\]>', r'\1', text, flags=re.DOTALL)
-        text = re.sub(r'<[^>]+>', '', text)
+        # 純文字沒有標籤或實體，只需整理空白
+        if '<' not in text and '&' not in text:
+            return _WS_RE.sub(' ', text).strip()
+        text = _CDATA_RE.sub(r'\1', text)
+        text = _TAG_RE.sub('', text)
         text = html.unescape(text)
-        return re.sub(r'\s+', ' ', text).strip()
+        return _WS_RE.sub(' ', text).strip()
 
     def parse_coordinates(self, coord_text: str) -> Tuple[Optional[float], Optional[float]]:
         """解析座標字串，回傳 (latitude, longitude)"""
-        if not coord_text or not coord_text.strip():
+        if not coord_text or coord_text.isspace():
             return None, None
         try:
-            parts = coord_text.strip().split(',')
+            # 只取第一組座標；限制切割次數，長 LineString/Polygon 不必切開整串
+            # float() 本身會忽略前後空白，因此不需先 strip 複製字串
+            parts = coord_text.split(',', 2)
             if len(parts) >= 2:
                 return float(parts[1]), float(parts[0])  # lat, lng
             return None, None
         except (ValueError, IndexError):
-            print(f"⚠️  無法解析座標: {coord_text}")
+            self.invalid_coordinate_count += 1
+            if self.verbose:
+                print(f"⚠️  無法解析座標: {coord_text}")
             return None, None
 
     def extract_placemarks_from_kml(self, kml_file: str, source_mid: str = "") -> List[Dict[str, Any]]:
         """從 KML 檔案提取所有 Placemark 資料"""
         self.placemarks = []
+        self.invalid_coordinate_count = 0
+        # 每層 Folder 為 [Folder 元素, 完整資料夾路徑]；路徑在第一次用到時才組成一次，
+        # 之後同一資料夾下的 Placemark 直接共用
+        folder_stack = []
+
+        def folder_path_at(level):
+            entry = folder_stack[level]
+            if entry[1] is None:
+                folder_name_elem = entry[0].find(KML_NAME)
+                folder_name = (folder_name_elem.text or "") if folder_name_elem is not None else ""
+                parent_path = folder_path_at(level - 1) if level > 0 else ""
+                entry[1] = f"{parent_path}/{folder_name}" if parent_path else folder_name
+            return entry[1]
+
         try:
-            tree = ET.parse(kml_file)
-            root = tree.getroot()
-
-            def process_element(element, folder_path=""):
-                if element.tag.endswith('Folder'):
-                    folder_name_elem = element.find('kml:name', self.ns)
-                    folder_name = folder_name_elem.text if folder_name_elem is not None else ""
-                    current_folder_path = f"{folder_path}/{folder_name}" if folder_path else folder_name
-                    for child in element:
-                        process_element(child, current_folder_path)
-                elif element.tag.endswith('Placemark'):
+            # 以 iterparse 串流解析，處理完的 Placemark 立即釋放，不需保留整棵樹
+            # lxml 可在 C 層只回報 Folder/Placemark 事件，其他節點不進入 Python 迴圈
+            iterparse_options = {'tag': (KML_FOLDER, KML_PLACEMARK)} if HAS_LXML else {}
+            for event, element in ET.iterparse(kml_file, events=('start', 'end'), **iterparse_options):
+                if element.tag == KML_FOLDER:
+                    if event == 'start':
+                        folder_stack.append([element, None])
+                    else:
+                        folder_stack.pop()
+                elif element.tag == KML_PLACEMARK and event == 'end':
+                    folder_path = folder_path_at(len(folder_stack) - 1) if folder_stack else ""
                     data = {'folder': folder_path if folder_path else "根目錄"}
 
-                    name_elem = element.find('kml:name', self.ns)
+                    name_elem = element.find(KML_NAME)
                     data['name'] = name_elem.text if name_elem is not None else ""
 
-                    desc_elem = element.find('kml:description', self.ns)
+                    desc_elem = element.find(KML_DESCRIPTION)
                     raw_description = desc_elem.text if desc_elem is not None else ""
                     data['description'] = self.clean_html_tags(raw_description)
 
-                    style_elem = element.find('kml:styleUrl', self.ns)
+                    style_elem = element.find(KML_STYLE_URL)
                     data['style_url'] = style_elem.text if style_elem is not None else ""
 
-                    coord_elem = element.find('.//kml:coordinates', self.ns)
+                    coord_elem = element.find(KML_COORDINATES)
                     if coord_elem is not None:
                         latitude, longitude = self.parse_coordinates(coord_elem.text)
                         data['latitude'] = latitude
@@ -85,14 +152,17 @@ class KMLParser:
                     data['source'] = source_mid
 
                     self.placemarks.append(data)
-                else:
-                    for child in element:
-                        process_element(child, folder_path)
 
-            process_element(root)
+                    # 釋放已處理的 Placemark；lxml 可一併移除前面已處理完的兄弟節點
+                    element.clear()
+                    if HAS_LXML:
+                        while element.getprevious() is not None:
+                            del element.getparent()[0]
         except (ET.ParseError, FileNotFoundError) as e:
             print(f"❌ 檔案錯誤: {e}")
             return []
+        if self.invalid_coordinate_count:
+            print(f"⚠️  {self.invalid_coordinate_count} 個 Placemark 的座標無法解析")
         return self.placemarks
 
     def save_to_csv(self, output_file: str, placemarks: Optional[List[Dict[str, Any]]] = None):
@@ -101,11 +171,12 @@ class KMLParser:
             print("❌ 沒有資料可以儲存")
             return
         try:
-            with open(output_file, 'w', newline='', encoding='utf-8') as csvfile:
-                writer = csv.DictWriter(csvfile, fieldnames=['folder', 'name', 'description', 'style_url', 'latitude', 'longitude', 'source'])
-                writer.writeheader()
-                for placemark in data_to_save:
-                    writer.writerow(placemark)
+            # 64 KiB 緩衝區，大量匯出時減少 write 系統呼叫次數
+            with open(output_file, 'w', newline='', encoding='utf-8', buffering=64 * 1024) as csvfile:
+                # 以 itemgetter 取出欄位後整批寫入，省去 DictWriter 逐列的欄位檢查
+                writer = csv.writer(csvfile)
+                writer.writerow(CSV_FIELDS)
+                writer.writerows(map(itemgetter(*CSV_FIELDS), data_to_save))
             print(f"✅ 成功儲存 {len(data_to_save)} 筆 Placemark 資料到 {output_file}")
         except IOError as e:
             print(f"❌ 儲存檔案錯誤: {e}")
@@ -122,7 +193,7 @@ class KMLParser:
         print(f"總共找到: {total_count} 個 Placemark")
         print(f"有座標: {with_coords} 個")
         print(f"無座標: {without_coords} 個")
-        if without_coords > 0:
+        if without_coords > 0 and self.verbose:
             print(f"\n⚠️  以下 {without_coords} 個 Placemark 沒有座標:")
             for i, placemark in enumerate(data_to_show, 1):
                 if placemark['latitude'] is None or placemark['longitude'] is None:
@@ -132,15 +203,60 @@ class KMLParser:
         return self.placemarks
 
 
+def parse_kml_file(kml_file: str, source_mid: str = "", verbose: bool = False) -> Tuple[List[Dict[str, Any]], str]:
+    """解析單一 KML 檔案，回傳 (Placemark 資料, 解析期間的輸出)
+
+    定義在模組層級以便交給 ProcessPoolExecutor 執行；輸出先收集起來，
+    由主行程在對應地圖的標題下輸出
+    """
+    log = io.StringIO()
+    with redirect_stdout(log):
+        placemarks = KMLParser(verbose=verbose).extract_placemarks_from_kml(kml_file, source_mid)
+    return placemarks, log.getvalue()
+
+
+class ThreadOutputBuffer:
+    """依執行緒分別收集 print 輸出，讓並行工作的紀錄能在之後整段輸出而不互相穿插"""
+
+    def __init__(self, stream):
+        self._stream = stream
+        self._local = threading.local()
+
+    def capture(self, func, *args):
+        """執行 func，回傳 (func 的結果, 執行期間輸出的文字)"""
+        self._local.buffer = io.StringIO()
+        try:
+            result = func(*args)
+            return result, self._local.buffer.getvalue()
+        finally:
+            self._local.buffer = None
+
+    def write(self, text: str) -> int:
+        buffer = getattr(self._local, 'buffer', None)
+        return (buffer if buffer is not None else self._stream).write(text)
+
+    def flush(self):
+        self._stream.flush()
+
+
 class GoogleMapsKMLDownloader:
     """Google Maps KML 下載器"""
 
-    def __init__(self):
+    def __init__(self, verbose: bool = False):
+        self.verbose = verbose
         self.session = requests.Session()
         # 設定 User-Agent 避免被阻擋
         self.session.headers.update({
             'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
         })
+        # 連線池讓多個地圖共用 TLS 連線，暫時性錯誤自動重試
+        adapter = HTTPAdapter(
+            pool_connections=DOWNLOAD_WORKERS,
+            pool_maxsize=DOWNLOAD_WORKERS * 2,
+            max_retries=Retry(total=3, backoff_factor=0.3, status_forcelist=[429, 500, 502, 503, 504]),
+        )
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
 
     def extract_map_id(self, url: str) -> Optional[str]:
         """從 Google Maps URL 中提取 map ID"""
@@ -183,35 +299,41 @@ class GoogleMapsKMLDownloader:
         try:
             print(f"🔄 開始下載 KML 檔案...")
 
-            response = self.session.get(url, timeout=30)
-            response.raise_for_status()
-
-            # 檢查回應內容是否為 KML 格式
-            content_type = response.headers.get('content-type', '').lower()
-            if 'xml' not in content_type and 'kml' not in content_type:
-                # 檢查內容是否包含 KML 標籤
-                if not ('<kml' in response.text.lower() or '<?xml' in response.text.lower()):
-                    print("⚠️  警告：下載的內容可能不是有效的 KML 檔案")
-                    print(f"   Content-Type: {content_type}")
-                    print(f"   內容預覽: {response.text[:200]}...")
-
-            # 儲存檔案
-            with open(output_file, 'w', encoding='utf-8') as file:
-                file.write(response.text)
+            # 串流下載，直接以位元組寫入檔案，不在記憶體中保留整份內容
+            with self.session.get(url, timeout=30, stream=True) as response:
+                response.raise_for_status()
+
+                chunks = response.iter_content(chunk_size=DOWNLOAD_CHUNK_SIZE)
+                first_chunk = next(chunks, b'')
+
+                # 檢查回應內容是否為 KML 格式
+                content_type = response.headers.get('content-type', '').lower()
+                if 'xml' not in content_type and 'kml' not in content_type:
+                    # 檢查第一個區塊是否包含 KML 標籤
+                    head = first_chunk.lower()
+                    if not (b'<kml' in head or b'<?xml' in head):
+                        print("⚠️  警告：下載的內容可能不是有效的 KML 檔案")
+                        print(f"   Content-Type: {content_type}")
+                        print(f"   內容預覽: {first_chunk[:200].decode('utf-8', errors='replace')}...")
+
+                # 儲存檔案
+                with open(output_file, 'wb') as file:
+                    file.write(first_chunk)
+                    for chunk in chunks:
+                        file.write(chunk)
 
             file_size = os.path.getsize(output_file)
             print(f"✅ 成功下載 KML 檔案: {output_file}")
             print(f"📊 檔案大小: {file_size} bytes")
 
-            # 顯示檔案內容預覽
-            with open(output_file, 'r', encoding='utf-8') as file:
-                preview = file.read(300)
-                print(f"📄 檔案內容預覽:")
-                print("-" * 50)
-                print(preview)
-                if len(preview) >= 300:
-                    print("...")
-                print("-" * 50)
+            # 顯示檔案內容預覽；直接使用已讀取的第一個區塊，非 UTF-8 的 KML 也不會因解碼失敗而中斷
+            preview = first_chunk[:1200].decode('utf-8', errors='replace')[:300]
+            print(f"📄 檔案內容預覽:")
+            print("-" * 50)
+            print(preview)
+            if len(preview) >= 300:
+                print("...")
+            print("-" * 50)
 
             return True
 
@@ -264,7 +386,7 @@ class GoogleMapsKMLDownloader:
             print("❌ 無法提取 Map ID，將使用空字串作為 source")
             map_id = ""
 
-        kml_parser = KMLParser()
+        kml_parser = KMLParser(verbose=self.verbose)
         placemarks = kml_parser.extract_placemarks_from_kml(kml_file, map_id)
         kml_parser.show_summary()
 
@@ -285,47 +407,56 @@ class GoogleMapsKMLDownloader:
 
         all_placemarks = []
         primary_map_records = set()  # 儲存地圖一的 (folder, name) 組合
-        kml_parser = KMLParser()
-
-        for i, source in enumerate(map_sources, 1):
+        kml_parser = KMLParser(verbose=self.verbose)
+
+        maps_urls = [f"https://www.google.com/maps/d/u/0/viewer?mid={source['mid']}" for source in map_sources]
+        kml_files = [f"data_{source['mid']}.kml" for source in map_sources]
+
+        # 並行下載所有地圖的 KML，等待網路 I/O 時不佔用 GIL
+        # 每個地圖的下載紀錄先個別收集，稍後在該地圖的處理標題下整段輸出
+        print(f"\n🔄 正在下載 {len(map_sources)} 個地圖的 KML 檔案...")
+        output = ThreadOutputBuffer(sys.stdout)
+        with redirect_stdout(output), ThreadPoolExecutor(max_workers=DOWNLOAD_WORKERS) as executor:
+            download_results = list(executor.map(partial(output.capture, self.download_from_maps_url), maps_urls, kml_files))
+
+        # 各地圖的 KML 互不相依，以多個行程並行解析 (XML 解析受 CPU 限制)
+        print(f"🔄 正在解析已下載的 KML 檔案...")
+        parse_workers = max(1, min(len(map_sources), os.cpu_count() or 1))
+        with ProcessPoolExecutor(max_workers=parse_workers) as executor:
+            parse_futures = [
+                executor.submit(parse_kml_file, kml_file, source['mid'], self.verbose) if downloaded else None
+                for source, kml_file, (downloaded, _) in zip(map_sources, kml_files, download_results)
+            ]
+            parse_results = [future.result() if future is not None else (None, "") for future in parse_futures]
+
+        for i, (source, (downloaded, download_log), (placemarks, parse_log)) in enumerate(zip(map_sources, download_results, parse_results), 1):
             map_id = source['mid']
             name = source.get('name', f'地圖{i}')
-            maps_url = f"https://www.google.com/maps/d/u/0/viewer?mid={map_id}"
-            kml_file = f"data_{map_id}.kml"
 
             print(f"\n📍 正在處理第 {i}/{len(map_sources)} 個地圖: {name}")
             print(f"   Map ID: {map_id}")
+            print(download_log, end="")
 
-            # 下載 KML
-            if self.download_from_maps_url(maps_url, kml_file):
-                # 解析 KML
+            if downloaded:
                 print(f"🔄 正在解析 {name} 的 KML 檔案...")
-                placemarks = kml_parser.extract_placemarks_from_kml(kml_file, map_id)
+                print(parse_log, end="")
 
                 if placemarks:
                     if i == 1:
                         # 第一個地圖（地圖一）：直接加入所有資料
                         all_placemarks.extend(placemarks)
                         # 建立地圖一的 (folder, name) 索引
-                        for placemark in placemarks:
-                            folder_name_key = (placemark.get('folder', ''), placemark.get('name', ''))
-                            primary_map_records.add(folder_name_key)
+                        primary_map_records = {(p.get('folder', ''), p.get('name', '')) for p in placemarks}
                         print(f"✅ 成功獲取 {len(placemarks)} 個 Placemark（主地圖）")
                     else:
-                        # 其他地圖：檢查是否與地圖一重複
-                        added_count = 0
-                        skipped_count = 0
-
-                        for placemark in placemarks:
-                            folder_name_key = (placemark.get('folder', ''), placemark.get('name', ''))
-
-                            if folder_name_key in primary_map_records:
-                                # 與地圖一重複，跳過
-                                skipped_count += 1
-                            else:
-                                # 不重複，加入
-                                all_placemarks.append(placemark)
-                                added_count += 1
+                        # 其他地圖：只加入與地圖一不重複的資料
+                        new_placemarks = [
+                            p for p in placemarks
+                            if (p.get('folder', ''), p.get('name', '')) not in primary_map_records
+                        ]
+                        all_placemarks.extend(new_placemarks)
+                        added_count = len(new_placemarks)
+                        skipped_count = len(placemarks) - added_count
 
                         print(f"✅ 成功獲取 {len(placemarks)} 個 Placemark，新增 {added_count} 個，跳過重複 {skipped_count} 個")
                 else:
@@ -375,20 +506,24 @@ def main():
     # 預設的 Google Maps URL (第一個地圖)
     default_url = f"https://www.google.com/maps/d/u/0/viewer?ll=23.67227849999999%2C121.4284911&z=13&mid={map_sources[0]['mid']}"
 
+    # --verbose 可放在任何位置，其餘參數依位置解析
+    verbose = "--verbose" in sys.argv[1:]
+    args = [arg for arg in sys.argv if arg != "--verbose"]
+
     # 檢查命令列參數
-    if len(sys.argv) > 1:
-        mode = sys.argv[1]
+    if len(args) > 1:
+        mode = args[1]
         if mode in ['--csv', '-c']:
             # CSV 模式：下載並解析為 CSV
-            maps_url = sys.argv[2] if len(sys.argv) > 2 else default_url
-            kml_file = sys.argv[3] if len(sys.argv) > 3 else "data.kml"
-            csv_file = sys.argv[4] if len(sys.argv) > 4 else "placemarks.csv"
+            maps_url = args[2] if len(args) > 2 else default_url
+            kml_file = args[3] if len(args) > 3 else "data.kml"
+            csv_file = args[4] if len(args) > 4 else "placemarks.csv"
 
             if maps_url == default_url:
                 print(f"ℹ️  使用預設 URL")
 
             try:
-                downloader = GoogleMapsKMLDownloader()
+                downloader = GoogleMapsKMLDownloader(verbose=verbose)
                 success = downloader.download_and_parse_to_csv(maps_url, kml_file, csv_file)
 
                 if success:
@@ -405,10 +540,10 @@ def main():
                 sys.exit(1)
         elif mode in ['--multi', '-m']:
             # 多地圖模式：下載多個地圖並合併為 CSV
-            csv_file = sys.argv[2] if len(sys.argv) > 2 else "placemarks.csv"
+            csv_file = args[2] if len(args) > 2 else "placemarks.csv"
 
             try:
-                downloader = GoogleMapsKMLDownloader()
+                downloader = GoogleMapsKMLDownloader(verbose=verbose)
                 success = downloader.download_multiple_maps_to_csv(map_sources, csv_file)
 
                 if success:
@@ -425,10 +560,10 @@ def main():
         else:
             # URL 作為第一個參數，只下載 KML
             maps_url = mode
-            output_file = sys.argv[2] if len(sys.argv) > 2 else "data.kml"
+            output_file = args[2] if len(args) > 2 else "data.kml"
 
             try:
-                downloader = GoogleMapsKMLDownloader()
+                downloader = GoogleMapsKMLDownloader(verbose=verbose)
                 success = downloader.download_from_maps_url(maps_url, output_file)
 
                 if success:
@@ -448,7 +583,7 @@ def main():
         print(f"ℹ️  將自動下載並合併多個地圖為 CSV")
 
         try:
-            downloader = GoogleMapsKMLDownloader()
+            downloader = GoogleMapsKMLDownloader(verbose=verbose)
             success = downloader.download_multiple_maps_to_csv(map_sources)
 
             if success:
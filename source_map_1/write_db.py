@@ -7,24 +7,67 @@
 
 import json
 import requests
+import threading
 import time
 import sys
 import os
-from typing import List, Dict, Any, Optional
+from collections import Counter, deque
+from concurrent.futures import ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
+from typing import List, Dict, Any, Iterator, Optional, Tuple
+
+# orjson (C 實作) 解析與輸出較快，未安裝時退回標準函式庫 json
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# ijson 可逐筆串流解析請求陣列，不必將整個檔案載入記憶體
+try:
+    import ijson
+except ImportError:
+    ijson = None
+
+JSON_DECODE_ERRORS = (json.JSONDecodeError, ijson.JSONError) if ijson else (json.JSONDecodeError,)
 
 
 class DatabaseWriter:
     """資料庫寫入器 - 執行 HTTP 請求更新資料庫"""
 
-    def __init__(self, delay_seconds: float = 0.5):
+    def __init__(self, delay_seconds: float = 0.5, verbose: bool = False, max_workers: int = 8):
         self.delay_seconds = delay_seconds
+        self.verbose = verbose
+        self.max_workers = max_workers
         self.success_count = 0
         self.error_count = 0
         self.skipped_count = 0
         self.results = []
-
-    def execute_request(self, request_data: Dict[str, Any]) -> bool:
-        """執行單個 HTTP 請求"""
+        # API 金鑰與標頭只在初始化時準備一次，所有請求共用
+        self._api_key = os.getenv('X_API_KEY')
+        self._patch_headers = {"x-api-key": self._api_key}
+        self._method_headers = {'PATCH': self._patch_headers, 'POST': None}
+        # 共用 Session 以重複使用連線，連線池大小配合並行數
+        self.session = requests.Session()
+        self.session.mount('https://', HTTPAdapter(pool_maxsize=max_workers))
+        self.session.mount('http://', HTTPAdapter(pool_maxsize=max_workers))
+        # 全域速率限制：所有執行緒送出請求的時間點至少間隔 delay_seconds
+        self._rate_lock = threading.Lock()
+        self._next_request_time = 0.0
+
+    def _wait_for_rate_limit(self):
+        """等待到下一個可送出請求的時間點"""
+        with self._rate_lock:
+            now = time.monotonic()
+            wait_seconds = self._next_request_time - now
+            self._next_request_time = max(now, self._next_request_time) + self.delay_seconds
+        if wait_seconds > 0:
+            time.sleep(wait_seconds)
+
+    def execute_request(self, request_data: Dict[str, Any]) -> Tuple[Optional[bool], Optional[Dict[str, Any]]]:
+        """執行單個 HTTP 請求，回傳 (是否成功, 執行結果)
+
+        執行結果由呼叫端依請求順序加入 self.results，不在工作執行緒中直接寫入
+        """
         method = request_data.get('http_method', '').upper()
         url = request_data.get('url', '')
         body = request_data.get('request_body', {})
@@ -33,27 +76,27 @@ class DatabaseWriter:
 
         if not method or not url:
             print(f"❌ 無效請求資料: {name}")
-            return False
+            return False, None
 
-        x_api_key = os.getenv('X_API_KEY')
-        if not x_api_key:
+        if not self._api_key:
             print("    ⚠️  未設定 X_API_KEY 環境變數，跳過 API 執行")
-            return None
+            return None, None
 
         try:
-            print(f"🔄 執行 {method} 請求: {name}")
-            print(f"body = {json.dumps(body)}")
+            if self.verbose:
+                print(f"🔄 執行 {method} 請求: {name}")
+                print(f"body = {json.dumps(body)}")
 
-            if method == 'PATCH':
-                response = requests.patch(url, json=body, headers={"x-api-key": x_api_key}, timeout=30)
-            elif method == 'POST':
-                response = requests.post(url, json=body, timeout=30)
-            else:
+            if method not in self._method_headers:
                 print(f"❌ 不支援的 HTTP 方法: {method}")
-                return False
+                return False, None
+
+            self._wait_for_rate_limit()
+            response = self.session.request(method, url, json=body, headers=self._method_headers[method], timeout=30)
 
             response.raise_for_status()
-            print(f"✅ {action} 成功: {name}")
+            if self.verbose:
+                print(f"✅ {action} 成功: {name}")
 
             # 記錄成功結果
             result = {
@@ -67,72 +110,81 @@ class DatabaseWriter:
             # 如果是 POST 請求，記錄創建的 ID
             if method == 'POST':
                 try:
-                    response_data = response.json()
+                    # orjson 直接解析原始位元組，省去文字解碼與標準 json 解析
+                    response_data = orjson.loads(response.content) if orjson else response.json()
                     if 'id' in response_data:
                         result['created_id'] = response_data['id']
-                except:
+                except (ValueError, TypeError):
                     pass
 
-            self.results.append(result)
-            return True
+            return True, result
 
         except requests.exceptions.RequestException as e:
-            print(f"❌ {action} 失敗: {name}")
-            self._log_api_error(method, url, body, e, getattr(e, 'response', None))
+            self._log_api_error(method, url, body, e, getattr(e, 'response', None),
+                                title=f"❌ {action} 失敗: {name}")
 
             # 記錄失敗結果
-            self.results.append({
+            return False, {
                 'name': name,
                 'action': action,
                 'method': method,
                 'status': 'error',
                 'error': str(e)
-            })
-            return False
+            }
 
     def _log_api_error(self, method: str, url: str, request_data: Dict[str, Any],
-                      exception: Exception, response=None):
+                      exception: Exception, response=None, title: Optional[str] = None):
         """記錄 API 請求錯誤的詳細資訊"""
-        print(f"  ❌ API 請求失敗:")
-        print(f"     方法: {method}")
-        print(f"     URL: {url}")
-        print(f"     錯誤: {exception}")
+        # 組成完整訊息後一次輸出，避免多個執行緒的錯誤紀錄互相穿插
+        lines = [title] if title else []
+        lines.append(f"  ❌ API 請求失敗:")
+        lines.append(f"     方法: {method}")
+        lines.append(f"     URL: {url}")
+        lines.append(f"     錯誤: {exception}")
 
         if response is not None:
-            print(f"     響應狀態碼: {response.status_code}")
+            lines.append(f"     響應狀態碼: {response.status_code}")
             try:
                 response_text = response.text
                 if response_text:
-                    print(f"     響應內容: {response_text}")
+                    lines.append(f"     響應內容: {response_text}")
                 else:
-                    print(f"     響應內容: (空)")
+                    lines.append(f"     響應內容: (空)")
             except Exception as e:
-                print(f"     無法讀取響應內容: {e}")
+                lines.append(f"     無法讀取響應內容: {e}")
         else:
-            print(f"     響應: 無響應 (連接錯誤或超時)")
+            lines.append(f"     響應: 無響應 (連接錯誤或超時)")
+
+        print("\n".join(lines))
 
     def process_json_file(self, json_file: str, confirm_before_execute: bool = True):
         """處理 JSON 檔案中的所有請求"""
         print(f"📂 讀取請求檔案: {json_file}")
 
+        if not self._api_key:
+            print("❌ 未設定 X_API_KEY 環境變數，無法執行 API 請求")
+            return
+
+        # 第一次串流掃描：只統計請求數量與類型，並確認整個檔案格式正確
         try:
-            with open(json_file, 'r', encoding='utf-8') as file:
-                requests_data = json.load(file)
+            total_requests = 0
+            method_counts = Counter()
+            for req in self._iter_requests(json_file):
+                total_requests += 1
+                method_counts[req.get('http_method', '')] += 1
         except FileNotFoundError:
             print(f"❌ 檔案不存在: {json_file}")
             return
-        except json.JSONDecodeError as e:
+        except JSON_DECODE_ERRORS as e:
             print(f"❌ JSON 解析錯誤: {e}")
             return
+        except TypeError as e:
+            print(f"❌ {e}")
+            return
         except Exception as e:
             print(f"❌ 讀取檔案錯誤: {e}")
             return
 
-        if not isinstance(requests_data, list):
-            print("❌ JSON 檔案格式錯誤：應該是請求物件的陣列")
-            return
-
-        total_requests = len(requests_data)
         if total_requests == 0:
             print("ℹ️  沒有找到任何請求")
             return
@@ -141,12 +193,13 @@ class DatabaseWriter:
         print("=" * 50)
 
         # 統計請求類型
-        patch_count = sum(1 for req in requests_data if req.get('http_method') == 'PATCH')
-        post_count = sum(1 for req in requests_data if req.get('http_method') == 'POST')
+        patch_count = method_counts['PATCH']
+        post_count = method_counts['POST']
 
         print(f"🔄 PATCH 請求: {patch_count} 個")
         print(f"🆕 POST 請求: {post_count} 個")
         print(f"⏱️  每次請求間隔: {self.delay_seconds} 秒")
+        print(f"🧵 並行請求數: {self.max_workers}")
 
         # 確認是否執行
         if confirm_before_execute:
@@ -159,18 +212,56 @@ class DatabaseWriter:
         print("\n🚀 開始執行請求...")
         print("=" * 50)
 
-        # 執行所有請求
-        for i, request_data in enumerate(requests_data, 1):
-            print(f"\n[{i}/{total_requests}]", end=" ")
-
-            if self.execute_request(request_data):
-                self.success_count += 1
-            else:
-                self.error_count += 1
+        # 第二次串流讀取並以多個執行緒並行執行，送出間隔由 _wait_for_rate_limit 控制
+        # 排隊中的請求數量有上限，記憶體用量不隨檔案大小增加
+        executor = ThreadPoolExecutor(max_workers=self.max_workers)
+        pending = deque()
+        completed = 0
+        try:
+            for request_data in self._iter_requests(json_file):
+                pending.append(executor.submit(self.execute_request, request_data))
+                if len(pending) >= self.max_workers * 2:
+                    completed += 1
+                    self._record_result(pending.popleft().result(), completed, total_requests)
+            while pending:
+                completed += 1
+                self._record_result(pending.popleft().result(), completed, total_requests)
+        except KeyboardInterrupt:
+            # 中斷時取消尚未送出的請求，不再寫入資料庫
+            executor.shutdown(wait=False, cancel_futures=True)
+            raise
+        executor.shutdown()
+
+    def _iter_requests(self, json_file: str) -> Iterator[Dict[str, Any]]:
+        """逐筆讀取 JSON 檔案中的請求；有 ijson 時串流解析，否則整份載入"""
+        with open(json_file, 'rb') as file:
+            if ijson:
+                events = ijson.parse(file, use_float=True)
+                first_event = next(events, None)
+                if first_event is None or first_event[1] != 'start_array':
+                    raise TypeError("JSON 檔案格式錯誤：應該是請求物件的陣列")
+                yield from ijson.items(events, 'item')
+                return
+            raw_data = file.read()
 
-            # 添加延遲避免觸及 API 限制 (除了最後一個請求)
-            if i < total_requests:
-                time.sleep(self.delay_seconds)
+        requests_data = orjson.loads(raw_data) if orjson else json.loads(raw_data)
+        if not isinstance(requests_data, list):
+            raise TypeError("JSON 檔案格式錯誤：應該是請求物件的陣列")
+        yield from requests_data
+
+    def _record_result(self, outcome: Tuple[Optional[bool], Optional[Dict[str, Any]]],
+                       index: int, total_requests: int):
+        """累計單個請求的執行結果 (在主執行緒依請求順序呼叫)"""
+        succeeded, result = outcome
+        if result is not None:
+            self.results.append(result)
+        if succeeded:
+            self.success_count += 1
+        else:
+            self.error_count += 1
+        # 每完成約 1% 的請求才輸出一次進度
+        if index == total_requests or index % max(1, total_requests // 100) == 0:
+            print(f"[{index}/{total_requests}] 完成")
 
     def save_results(self, output_file: str = "write_db_results.json"):
         """保存執行結果到 JSON 檔案"""
@@ -179,8 +270,12 @@ class DatabaseWriter:
             return
 
         try:
-            with open(output_file, 'w', encoding='utf-8') as file:
-                json.dump(self.results, file, ensure_ascii=False, indent=2)
+            if orjson:
+                with open(output_file, 'wb') as file:
+                    file.write(orjson.dumps(self.results, option=orjson.OPT_INDENT_2))
+            else:
+                with open(output_file, 'w', encoding='utf-8') as file:
+                    json.dump(self.results, file, ensure_ascii=False, indent=2)
             print(f"\n💾 執行結果已儲存到: {output_file}")
         except Exception as e:
             print(f"❌ 儲存結果檔案錯誤: {e}")
@@ -207,15 +302,16 @@ def main():
 
     # 檢查命令列參數
     json_file = sys.argv[1] if len(sys.argv) > 1 else "water_stations_sync_requests.json"
-    confirm = True
 
-    # 檢查是否有 --no-confirm 參數
-    if len(sys.argv) > 2 and sys.argv[2] == "--no-confirm":
-        confirm = False
+    # 檢查是否有 --no-confirm 參數 (可與其他選項任意排列)
+    confirm = "--no-confirm" not in sys.argv[2:]
+
+    # 檢查是否有 --verbose 參數 (顯示每個請求的 body)
+    verbose = "--verbose" in sys.argv[2:]
 
     try:
         # 創建資料庫寫入器
-        writer = DatabaseWriter(delay_seconds=0.5)
+        writer = DatabaseWriter(delay_seconds=0.5, verbose=verbose)
 
         # 處理 JSON 檔案
         writer.process_json_file(json_file, confirm_before_execute=confirm)